@@ -1,55 +1,106 @@
+import hashlib
+import io
 import os
+import queue
+import random
 import re
+import shutil
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import Optional, List, Tuple, Dict, Any
+from typing import Optional, List, Tuple, Dict, Any, Iterator, Callable
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import numpy as np
+import cv2
 import gspread
-from bs4 import BeautifulSoup
-from pdf2image import convert_from_path
+from bs4 import BeautifulSoup, SoupStrainer
+import pypdfium2 as pdfium
 import easyocr
-from PIL import Image
+import torch
 
 # Configuration
-POPPLER_PATH = r"C:\Program Files\poppler-24.08.0\Library\bin"
 SHEET_ID = "your_sheet_id_here"
 CREDENTIALS_FILE = os.path.join(os.path.dirname(__file__), "credentials.json")
 WEB = "https://cafef.vn/du-lieu/Ajax/CongTy/BaoCaoTaiChinh.aspx?sym="
+HTTP_TIMEOUT = (5, 60)  # Seconds to connect, and to wait for data, on cafef.vn requests
+PDF_DPI = 200  # Rendering resolution; configured regions are pixel coordinates at this DPI
+OCR_BATCH_SIZE = 8  # Pages sent through the OCR models in one forward pass
+OCR_BATCH_ALIGN = 256  # Differently sized images are padded to multiples of this so they can share a batch
+OCR_CROP_MARGIN = 20  # Pixels kept around the configured regions when cropping pages for OCR
+OCR_CROP_MAX_AREA = 0.7  # OCR the full page when the cropped area would exceed this fraction
+OCR_SCALE = 1.0  # Downscale factor applied to page crops before OCR; below 1.0 trades accuracy for speed
+MAX_WORKERS = 4  # Companies processed concurrently
+SHEETS_MAX_ATTEMPTS = 6  # Tries per Google Sheets write when the API quota is exceeded
+RENDER_CACHE_BYTES = 64 * 1024 * 1024  # Memory for recently rendered pages (about 5 A4 pages), so running both menu options on a report renders it once
+RENDER_CACHE_ON_DISK = os.getenv("RENDER_CACHE_ON_DISK") == "1"  # Keep configured pages on disk across runs; off by default as each page takes about 12 MB
+RENDER_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")  # Where RENDER_CACHE_ON_DISK keeps pages; safe to delete while the script is not running
+OCR_FP16 = True  # Run EasyOCR in float16 on GPU; set to False if recognition quality drops
+OCR_BACKEND = os.getenv("OCR_BACKEND", "easyocr")  # "easyocr", "onnx" for EasyOCR with its detector on ONNX Runtime, or "rapidocr" for OpenVINO on CPU
+ONNX_DETECTOR_FILE = os.path.join(os.path.dirname(__file__), "craft.onnx")  # EasyOCR detector exported for the "onnx" backend
+
+# HTTP session shared by all cafef.vn requests so connections are kept alive
+_SESSION = requests.Session()
+_SESSION.mount('https://', HTTPAdapter(
+    pool_connections=8,
+    pool_maxsize=16,
+    # Also retry when cafef.vn rate-limits or has a transient server error
+    max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+))
+
+# PDFium is not thread-safe, so pages are rendered by one thread at a time
+_PDFIUM_LOCK = threading.Lock()
+# Recently rendered pages keyed by (PDF digest, page number, DPI), least recently used first
+_RENDER_CACHE: "OrderedDict[Tuple[str, int, int], np.ndarray]" = OrderedDict()
+
+# OCR engine, loaded lazily and shared by every company processed in this run
+_READER: Any = None
+# The reader is not thread-safe, so OCR calls from worker threads are serialized
+_OCR_LOCK = threading.Lock()
+
+# Characters removed by clean_text
+_SPECIAL_CHARS_RE = re.compile(r'[^\w\s\u00C0-\u00FF.,;:()%]')
+
+class _SpecialCharsTable(dict):
+    """str.translate table deleting the characters matched by _SPECIAL_CHARS_RE.
+    
+    Entries are computed on first lookup, so only characters that actually
+    occur in OCR output are ever classified.
+    """
+
+    def __missing__(self, codepoint: int) -> Optional[int]:
+        value = None if _SPECIAL_CHARS_RE.match(chr(codepoint)) else codepoint
+        self[codepoint] = value
+        return value
+
+_SPECIAL_CHARS_TABLE = _SpecialCharsTable()
 
 def clean_text(text: str) -> str:
     """Clean and normalize text by removing extra spaces and special characters."""
-    text = re.sub(r'\s+', ' ', text)
-    text = re.sub(r'[^\w\s\u00C0-\u00FF.,;:()%]', '', text)
-    text = re.sub(r'\n\s*\n', '\n\n', text)
-    return text.strip()
+    # Collapse whitespace runs into single spaces, then drop special characters
+    text = ' '.join(text.split())
+    return text.translate(_SPECIAL_CHARS_TABLE).strip()
 
-def download_pdf(url: str, save_path: str) -> bool:
-    """Download PDF from URL and save to specified path."""
+def download_pdf(url: str) -> Optional[bytes]:
+    """Download PDF from URL and return its content."""
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            with open(save_path, "wb") as pdf_file:
-                for chunk in response.iter_content(1024):
-                    pdf_file.write(chunk)
-            print(f"PDF downloaded successfully: {save_path}")
-            return True
-        print(f"Failed to download PDF. Status code: {response.status_code}")
-        return False
+        with _SESSION.get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+            if response.status_code != 200:
+                print(f"Failed to download PDF. Status code: {response.status_code}")
+                return None
+            # Copy the raw stream in 1 MiB reads, letting urllib3 undo any gzip encoding
+            response.raw.decode_content = True
+            buffer = io.BytesIO()
+            shutil.copyfileobj(response.raw, buffer, 1024 * 1024)
+        print(f"PDF downloaded successfully: {url}")
+        return buffer.getvalue()
     except Exception as e:
         print(f"Error downloading PDF: {str(e)}")
-        return False
-
-def is_box_in_region(box: List[Tuple[float, float]], region: Tuple[int, int, int, int]) -> bool:
-    """Check if a text box intersects with the target region."""
-    x1, y1, x2, y2 = region
-    box = np.array(box, dtype=np.float32)
-    
-    # Check if any corner of the text box is inside the region
-    for point in box:
-        if (x1 <= point[0] <= x2) and (y1 <= point[1] <= y2):
-            return True
-    return False
+        return None
 
 def get_sheet_data() -> Optional[gspread.Spreadsheet]:
     """Initialize and return Google Sheets client."""
@@ -115,10 +166,15 @@ def get_sheet_data() -> Optional[gspread.Spreadsheet]:
 def get_pdf_file(code: str) -> Optional[str]:
     """Get PDF URL for a given company code."""
     try:
-        response = requests.get(WEB + code)
+        response = _SESSION.get(WEB + code, timeout=HTTP_TIMEOUT)
         if response.status_code == 200:
-            soup = BeautifulSoup(response.text, 'html.parser')
-            tables = soup.find_all('table')
+            # Build the tree from the raw bytes, only for tables: the rest of the page is never read.
+            # requests falls back to ISO-8859-1 for HTML without a declared charset, which would
+            # garble Vietnamese text, so only a declared charset overrides BeautifulSoup's detection.
+            declared_encoding = response.encoding if 'charset' in response.headers.get('content-type', '') else None
+            soup = BeautifulSoup(response.content, 'lxml', parse_only=SoupStrainer('table'), from_encoding=declared_encoding)
+            # Only the second table is used, so stop searching once it is found
+            tables = soup.find_all('table', limit=2)
             
             if len(tables) > 1:
                 second_table = tables[1]
@@ -147,56 +203,81 @@ def get_pdf_file(code: str) -> Optional[str]:
         print("Error fetching the URL:", e)
         return None
 
-def save_image(code: str, img: Image.Image, page_num: int) -> str:
+def save_image(code: str, img: np.ndarray, page_num: int) -> str:
     """Save image to local storage.
     
     Args:
-        img: PIL Image object
+        code: Company code
+        img: Page image as RGB numpy array
         page_num: Page number for filename
-        keepImage: Whether to keep the image after processing
         
     Returns:
         Path to saved image
     """
     image_path = f"images/{code}/page_{page_num}.png"
     os.makedirs(os.path.dirname(image_path), exist_ok=True)
-    img.save(image_path, "PNG")
+    # OpenCV encodes without holding the GIL, so pages can be saved in parallel.
+    # Lowest zlib level: much faster to encode, still lossless
+    if not cv2.imwrite(image_path, cv2.cvtColor(img, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_PNG_COMPRESSION, 1]):
+        raise OSError(f"Could not write image {image_path}")
     return image_path
 
-def select_text_in_region(ocr_results: List[Tuple], region: Tuple[int, int, int, int], confidence_threshold: float = 0.5) -> List[Tuple[str, float]]:
-    """Select text that falls within the specified region.
+def ocr_results_to_arrays(ocr_results: List[Tuple]) -> Tuple[np.ndarray, List[str], np.ndarray]:
+    """Split OCR results into arrays so regions can be checked in one pass.
     
     Args:
         ocr_results: List of OCR results (box, text, confidence)
-        region: Tuple of (x1, y1, x2, y2) coordinates
-        confidence_threshold: Minimum confidence score for text selection
         
     Returns:
-        List of tuples containing (text, confidence) for selected text
+        Tuple of (boxes, texts, confidences) where boxes has shape (N, 4, 2)
     """
-    found_texts = []
-    for detection in ocr_results:
-        box = detection[0]  # Bounding box coordinates
-        text = detection[1]  # The actual text content
-        confidence = detection[2]  # Confidence score
+    boxes = np.array([detection[0] for detection in ocr_results], dtype=np.float32).reshape(-1, 4, 2)
+    texts = [detection[1] for detection in ocr_results]
+    confidences = np.fromiter((detection[2] for detection in ocr_results), dtype=np.float32, count=len(ocr_results))
+    return boxes, texts, confidences
+
+def select_text_in_regions(boxes: np.ndarray, texts: List[str], confidences: np.ndarray, regions: List[Tuple[int, int, int, int]], confidence_threshold: float = 0.5) -> List[List[Tuple[str, float]]]:
+    """Select the text that falls within each of the specified regions.
+    
+    Args:
+        boxes: Bounding boxes of the OCR results, shape (N, 4, 2)
+        texts: Text of the OCR results
+        confidences: Confidence scores of the OCR results, shape (N,)
+        regions: Regions as (x1, y1, x2, y2) tuples
+        confidence_threshold: Minimum confidence score for text selection
         
-        try:
-            if is_box_in_region(box, region) and confidence > confidence_threshold:
-                found_texts.append((text, confidence))
-        except Exception as e:
-            print(f"Warning: Error checking box {box}: {str(e)}")
-            continue
+    Returns:
+        For each region, a list of tuples containing (text, confidence) for selected text, top to bottom
+    """
+    # Sort by the y-coordinate of the box centroid to maintain reading order
+    order = np.argsort(boxes[:, :, 1].mean(axis=1), kind='stable')
+    boxes = boxes[order]
+    
+    # Broadcast every box corner (1, N, 4) against every region (R, 1, 1)
+    region_bounds = np.array(regions, dtype=np.float32).reshape(-1, 4)[:, :, None, None]
+    xs = boxes[None, :, :, 0]
+    ys = boxes[None, :, :, 1]
+    x1, y1, x2, y2 = region_bounds[:, 0], region_bounds[:, 1], region_bounds[:, 2], region_bounds[:, 3]
+    
+    # A text box intersects a region if any of its corners is inside it
+    in_region = ((xs >= x1) & (xs <= x2) & (ys >= y1) & (ys <= y2)).any(axis=-1)  # (R, N)
+    selected = in_region & (confidences[order] > confidence_threshold)
     
-    return found_texts
+    return [
+        [(texts[i], float(confidences[i])) for i in order[np.flatnonzero(region_selected)]]
+        for region_selected in selected
+    ]
 
-def get_company_code() -> Optional[str]:
-    """Get company code from user input with option to cancel."""
+def get_company_codes() -> Optional[List[str]]:
+    """Get one or more comma-separated company codes from user input with option to cancel."""
     while True:
-        code = input("Enter company code (or 'C' to cancel): ").strip().upper()
-        if code == 'C':
+        codes_input = input("Enter company codes separated by commas (or 'C' to cancel): ").strip().upper()
+        if codes_input == 'C':
             return None
-        if code:
-            return code
+        codes = [code.strip() for code in codes_input.split(',') if code.strip()]
+        if codes:
+            # Drop duplicates while keeping the entered order
+            return list(dict.fromkeys(codes))
         print("Please enter a valid company code")
 
 def get_page_range() -> Tuple[Optional[int], Optional[int]]:
@@ -252,12 +333,103 @@ def clear_images(code: str) -> None:
     except Exception as e:
         print(f"Error clearing images: {str(e)}")
 
-def process_images_only(code: str, pdf_path: str, start_page: int = 1, end_page: Optional[int] = None) -> None:
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    """Return the number of pages of a PDF without rendering them."""
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+def _render_page(pdf: pdfium.PdfDocument, page_num: int, digest: str, cache_on_disk: bool) -> np.ndarray:
+    """Render one page at PDF_DPI, or memory-map it from RENDER_CACHE_DIR if it was cached before.
+    
+    Args:
+        pdf: Open PDF document
+        page_num: Page number to render (1-based)
+        digest: SHA-256 of the PDF content
+        cache_on_disk: Whether to use RENDER_CACHE_DIR for this page; ignored
+            unless RENDER_CACHE_ON_DISK is enabled
+        
+    Returns:
+        Page image as RGB numpy array
+    """
+    cache_on_disk = cache_on_disk and RENDER_CACHE_ON_DISK
+    cache_path = os.path.join(RENDER_CACHE_DIR, f"{digest}_{page_num}_{PDF_DPI}.npy")
+    if cache_on_disk and os.path.exists(cache_path):
+        return np.asarray(np.load(cache_path, mmap_mode='r'))
+    
+    page = pdf[page_num - 1]
+    try:
+        image = np.asarray(page.render(scale=PDF_DPI / 72).to_pil())
+    finally:
+        page.close()
+    if not cache_on_disk:
+        return image
+    
+    # Write to a temporary file first so an interrupted run never leaves a truncated page behind
+    temp_path = cache_path + ".tmp"
+    try:
+        os.makedirs(RENDER_CACHE_DIR, exist_ok=True)
+        with open(temp_path, 'wb') as cache_file:
+            np.save(cache_file, image)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        # The cache is only an optimization, so a read-only folder or full disk must not stop rendering
+        print(f"Warning: could not cache page {page_num}: {str(e)}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+    return image
+
+def render_pdf_pages(pdf_bytes: bytes, page_nums: List[int], cache_on_disk: bool = False) -> Iterator[Tuple[int, np.ndarray]]:
+    """Render pages of a PDF at PDF_DPI, one at a time.
+    
+    Pages rendered recently from the same PDF content are served from
+    _RENDER_CACHE, and, with RENDER_CACHE_ON_DISK, pages cached in earlier
+    runs from RENDER_CACHE_DIR, instead of being rendered again.
+    
+    Args:
+        pdf_bytes: Content of the PDF file
+        page_nums: Page numbers to render (1-based). Pages that do not exist
+            in the PDF are skipped.
+        cache_on_disk: Whether to use RENDER_CACHE_DIR for these pages when
+            RENDER_CACHE_ON_DISK is enabled. Each page takes about 12 MB, so
+            only the few configured pages of the text extraction are cached.
+        
+    Yields:
+        Tuples of (page number, page image as RGB numpy array)
+    """
+    digest = hashlib.sha256(pdf_bytes).hexdigest()
+    with _PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            total_pages = len(pdf)
+            for page_num in page_nums:
+                if not 1 <= page_num <= total_pages:
+                    continue
+                key = (digest, page_num, PDF_DPI)
+                image = _RENDER_CACHE.get(key)
+                if image is None:
+                    image = _render_page(pdf, page_num, digest, cache_on_disk)
+                    _RENDER_CACHE[key] = image
+                    # Evict the least recently used pages beyond the memory budget
+                    while _RENDER_CACHE and sum(cached.nbytes for cached in _RENDER_CACHE.values()) > RENDER_CACHE_BYTES:
+                        _RENDER_CACHE.popitem(last=False)
+                else:
+                    _RENDER_CACHE.move_to_end(key)
+                yield page_num, image
+        finally:
+            pdf.close()
+
+def process_images_only(code: str, pdf_bytes: bytes, start_page: int = 1, end_page: Optional[int] = None) -> None:
     """Process PDF and save specified pages as images without text extraction.
     
     Args:
         code: Company code
-        pdf_path: Path to the PDF file
+        pdf_bytes: Content of the PDF file
         start_page: First page to process (1-based)
         end_page: Last page to process (1-based), None for all pages
     """
@@ -265,9 +437,7 @@ def process_images_only(code: str, pdf_path: str, start_page: int = 1, end_page:
         # Clear existing images for this company
         clear_images(code)
         
-        # Convert PDF to images
-        images = convert_from_path(pdf_path, poppler_path=POPPLER_PATH)
-        total_pages = len(images)
+        total_pages = count_pdf_pages(pdf_bytes)
         
         # Validate page numbers
         if start_page < 1:
@@ -285,98 +455,535 @@ def process_images_only(code: str, pdf_path: str, start_page: int = 1, end_page:
             
         print(f"\nProcessing PDF pages {start_page} to {end_page} of {total_pages}...")
         
-        # Save specified pages as images
-        for i in range(start_page - 1, end_page):
-            img = images[i]
-            image_path = save_image(code, img, i + 1)
-            print(f"Saved page {i + 1} to {image_path}")
+        # Render only the specified pages. PDFium renders one page at a time, so
+        # the pages are encoded and saved on worker threads while the next renders.
+        with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+            saved_pages = [
+                (page_num, executor.submit(save_image, code, img, page_num))
+                for page_num, img in render_pdf_pages(pdf_bytes, list(range(start_page, end_page + 1)))
+            ]
+            for page_num, future in saved_pages:
+                print(f"Saved page {page_num} to {future.result()}")
             
         print(f"\nAll pages from {start_page} to {end_page} have been saved as images.")
         
     except Exception as e:
         print(f"Error processing PDF: {str(e)}")
-        print("\nPlease make sure you have:")
-        print("1. Installed Poppler from: https://github.com/oschwartz10612/poppler-windows/releases/")
-        print("2. Set the correct POPPLER_PATH in the code to match your installation")
+        print("\nPlease make sure you have installed pypdfium2 using: pip install pypdfium2")
+
+class _HalfPrecision(torch.nn.Module):
+    """Run a wrapped model in float16 and channels_last under autocast and return float32 outputs."""
+
+    def __init__(self, module: torch.nn.Module):
+        super().__init__()
+        # Store the weights in float16 so autocast does not cast them on every call,
+        # and in channels_last (NHWC), the layout Tensor Core convolutions prefer
+        self.module = module.half().to(memory_format=torch.channels_last)
+
+    def forward(self, *args):
+        # Give image batches the same layout and precision as the weights
+        args = tuple(
+            arg.to(dtype=torch.float16, memory_format=torch.channels_last, non_blocking=True)
+            if isinstance(arg, torch.Tensor) and arg.dim() == 4 and arg.is_floating_point() else arg
+            for arg in args
+        )
+        with torch.autocast('cuda', dtype=torch.float16):
+            outputs = self.module(*args)
+        # EasyOCR post-processes the outputs with OpenCV, which does not accept float16
+        if isinstance(outputs, tuple):
+            return tuple(output.float() for output in outputs)
+        return outputs.float()
+
+class _OnnxDetector:
+    """Stand-in for EasyOCR's CRAFT detector that runs an exported copy on ONNX Runtime."""
+
+    def __init__(self, detector: torch.nn.Module):
+        # Optional dependency, only needed when this backend is selected
+        import onnxruntime as ort
+        
+        # EasyOCR wraps the detector in DataParallel on GPU
+        detector = getattr(detector, 'module', detector)
+        if not os.path.exists(ONNX_DETECTOR_FILE):
+            # Export once; the file is reused by later runs
+            device = next(detector.parameters()).device
+            dummy = torch.zeros((1, 3, 640, 640), device=device)
+            torch.onnx.export(
+                detector, dummy, ONNX_DETECTOR_FILE, opset_version=17,
+                input_names=['image'], output_names=['y', 'feature'],
+                # The outputs are half-resolution maps, y laid out NHWC and feature NCHW
+                dynamic_axes={
+                    'image': {0: 'batch', 2: 'height', 3: 'width'},
+                    'y': {0: 'batch', 1: 'map_height', 2: 'map_width'},
+                    'feature': {0: 'batch', 2: 'map_height', 3: 'map_width'},
+                },
+            )
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = os.cpu_count() or 1
+        self.session = ort.InferenceSession(ONNX_DETECTOR_FILE, sess_options=options, providers=ort.get_available_providers())
 
-def process_text_only(pdf_path: str, configs: List[str]) -> List[Dict[str, str]]:
-    """Process PDF and extract text without saving images."""
+    def __call__(self, images: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+        y, feature = self.session.run(None, {'image': images.cpu().numpy()})
+        return torch.from_numpy(y), torch.from_numpy(feature)
+
+def _get_reader() -> Any:
+    """Return the shared OCR engine selected by OCR_BACKEND, loading the models on first use."""
+    global _READER
+    if _READER is None:
+        if OCR_BACKEND in ("easyocr", "onnx"):
+            # Initialize EasyOCR with Vietnamese and English support.
+            # Use the GPU when one is available; on CPU the models are int8-quantized.
+            use_gpu = torch.cuda.is_available()
+            use_onnx = OCR_BACKEND == "onnx"
+            # Build the reader locally and only share it once it is fully set up,
+            # so a failed ONNX export never leaves a half-configured reader behind
+            reader = easyocr.Reader(['vi', 'en'], gpu=use_gpu, cudnn_benchmark=use_gpu, quantize=True)
+            if use_onnx:
+                reader.detector = _OnnxDetector(reader.detector)
+            elif use_gpu and OCR_FP16:
+                reader.detector = _HalfPrecision(reader.detector)
+            if use_gpu and OCR_FP16:
+                reader.recognizer = _HalfPrecision(reader.recognizer)
+            if use_gpu:
+                # Warm up once so CUDA and cuDNN are initialized before the first real page.
+                # This deliberately uses one padded blank A4 page rather than a full
+                # OCR_BATCH_SIZE batch: runtime batches are cropped and padded to shapes
+                # that vary per report, so cudnn_benchmark autotunes each new shape when
+                # it first occurs anyway, and a full batch would only cost startup time
+                # and GPU memory.
+                blank_page = np.zeros((round(11.69 * PDF_DPI), round(8.27 * PDF_DPI), 3), dtype=np.uint8)
+                with torch.inference_mode():
+                    reader.readtext_batched([_pad_to_multiple(blank_page, OCR_BATCH_ALIGN)], batch_size=1)
+            _READER = reader
+        elif OCR_BACKEND == "rapidocr":
+            # Optional dependency, only needed when this backend is selected
+            from rapidocr_openvino import RapidOCR
+            _READER = RapidOCR()
+        else:
+            raise ValueError(f"Unknown OCR_BACKEND '{OCR_BACKEND}', expected 'easyocr', 'onnx' or 'rapidocr'")
+    return _READER
+
+def _preload_reader() -> None:
+    """Load the shared OCR engine ahead of the first page, so the model load overlaps downloading."""
     try:
-        # Initialize EasyOCR with Vietnamese and English support
-        reader = easyocr.Reader(['vi', 'en'])
+        with _OCR_LOCK:
+            _get_reader()
+    except Exception as e:
+        print(f"Error loading OCR models: {str(e)}")
+
+def _pad_to_multiple(img: np.ndarray, multiple: int) -> np.ndarray:
+    """Pad an image with white on the bottom and right up to a multiple of `multiple` pixels."""
+    height, width = img.shape[:2]
+    pad_height = -height % multiple
+    pad_width = -width % multiple
+    if not pad_height and not pad_width:
+        return img
+    return np.pad(img, ((0, pad_height), (0, pad_width), (0, 0)), constant_values=255)
+
+def _read_pages(images: List[np.ndarray]) -> List[List[Tuple]]:
+    """Run OCR over several page images, batching pages that share a size.
+    
+    Args:
+        images: Page images as RGB numpy arrays
         
-        # Convert PDF to images once for all regions
-        images = convert_from_path(pdf_path, poppler_path=POPPLER_PATH)
+    Returns:
+        OCR results (box, text, confidence) for each image, in input order
+    """
+    if OCR_BACKEND == "rapidocr":
+        with _OCR_LOCK:
+            reader = _get_reader()
+            results = []
+            for img in images:
+                # RapidOCR has no batched API and expects BGR images
+                ocr_results, _ = reader(np.ascontiguousarray(img[:, :, ::-1]))
+                results.append([(box, text, float(confidence)) for box, text, confidence in ocr_results or []])
+        return results
+    
+    # Pages are only batched with pages of the same size so that no resizing
+    # happens and the returned boxes stay in page coordinates. Cropped pages
+    # rarely match exactly, so they are padded on the bottom and right, which
+    # leaves coordinates unchanged, up to a coarse grid of sizes.
+    if len({img.shape for img in images}) > 1:
+        images = [_pad_to_multiple(img, OCR_BATCH_ALIGN) for img in images]
+    by_shape: Dict[Tuple[int, ...], List[int]] = {}
+    for index, img in enumerate(images):
+        by_shape.setdefault(img.shape, []).append(index)
+    
+    results: List[List[Tuple]] = [[] for _ in images]
+    with _OCR_LOCK:
+        # Load the models outside inference mode: quantizing, converting and
+        # exporting them must not turn their parameters into inference tensors
+        reader = _get_reader()
+        # Skip autograd bookkeeping: the models are only ever used for inference
+        with torch.inference_mode():
+            for indices in by_shape.values():
+                # The detector sees the whole list at once, so chunk it to bound memory
+                for start in range(0, len(indices), OCR_BATCH_SIZE):
+                    chunk = indices[start:start + OCR_BATCH_SIZE]
+                    batch = reader.readtext_batched([images[i] for i in chunk], batch_size=OCR_BATCH_SIZE)
+                    for index, ocr_results in zip(chunk, batch):
+                        results[index] = ocr_results
+    return results
+
+def parse_configs(configs: List[str]) -> Dict[int, List[Dict[str, Any]]]:
+    """Group region configurations by page number.
+    
+    Args:
+        configs: Configuration strings in format "page,target_cell,x1,y1,x2,y2"
         
-        # Group configs by page number to minimize image processing
-        page_configs = {}
-        for config in configs:
-            if not config:
-                continue
-            parts = config.split(',')
-            if len(parts) < 6:
-                continue
-                
-            page_num = int(parts[0])
-            if page_num not in page_configs:
-                page_configs[page_num] = []
-            page_configs[page_num].append({
-                'target_cell': parts[1],
-                'region': (
-                    int(parts[2]),  # x1
-                    int(parts[3]),  # y1
-                    int(parts[4]),  # x2
-                    int(parts[5])   # y2
-                )
-            })
+    Returns:
+        Dictionary mapping page numbers to their target cells and regions
+    """
+    page_configs = {}
+    for config in configs:
+        if not config:
+            continue
+        parts = config.split(',')
+        if len(parts) < 6:
+            continue
+        
+        # Check the A1 reference once here, so a typo does not fail the whole sheet update
+        target_cell = parts[1].strip().upper()
+        try:
+            gspread.utils.a1_to_rowcol(target_cell)
+        except gspread.exceptions.IncorrectCellLabel:
+            print(f"Skipping config '{config}': invalid target cell '{target_cell}'")
+            continue
         
-        results = []
-        # Process each page once
-        for page_num, configs in page_configs.items():
-            # Adjust page number to 0-based index
-            page_index = page_num - 1
+        # A bad number only skips its own config, not the company's other configs
+        try:
+            page_num = int(parts[0])
+            region = (
+                int(parts[2]),  # x1
+                int(parts[3]),  # y1
+                int(parts[4]),  # x2
+                int(parts[5])   # y2
+            )
+        except ValueError:
+            print(f"Skipping config '{config}': invalid page number or coordinates")
+            continue
             
-            if page_index < 0 or page_index >= len(images):
-                print(f"Error: Page {page_num} does not exist in the PDF (total pages: {len(images)})")
+        if page_num not in page_configs:
+            page_configs[page_num] = []
+        page_configs[page_num].append({
+            # A1 reference used as-is as the range of the sheet update
+            'target_cell': target_cell,
+            'region': region
+        })
+    return page_configs
+
+def render_configured_pages(pdf_bytes: bytes, page_configs: Dict[int, List[Dict[str, Any]]]) -> Iterator[Tuple[int, np.ndarray]]:
+    """Render the pages referenced by the configurations, one at a time.
+    
+    Args:
+        pdf_bytes: Content of the PDF file
+        page_configs: Configurations grouped by page number
+        
+    Yields:
+        Tuples of (page number, page image as numpy array)
+    """
+    # Render only the configured pages rather than the whole report
+    rendered_pages = set()
+    for page_num, img in render_pdf_pages(pdf_bytes, sorted(page_configs), cache_on_disk=True):
+        rendered_pages.add(page_num)
+        yield page_num, img
+    
+    for page_num in sorted(set(page_configs) - rendered_pages):
+        print(f"Error: Page {page_num} does not exist in the PDF (total pages: {count_pdf_pages(pdf_bytes)})")
+
+def crop_to_regions(img: np.ndarray, regions: List[Tuple[int, int, int, int]]) -> Tuple[np.ndarray, Tuple[int, int]]:
+    """Crop a page image to the area covering all regions, plus a margin.
+    
+    Args:
+        img: Page image as numpy array
+        regions: Regions as (x1, y1, x2, y2) tuples
+        
+    Returns:
+        Tuple of (cropped image, (x, y) offset of the crop in the page)
+    """
+    height, width = img.shape[:2]
+    x1 = max(min(region[0] for region in regions) - OCR_CROP_MARGIN, 0)
+    y1 = max(min(region[1] for region in regions) - OCR_CROP_MARGIN, 0)
+    x2 = min(max(region[2] for region in regions) + OCR_CROP_MARGIN, width)
+    y2 = min(max(region[3] for region in regions) + OCR_CROP_MARGIN, height)
+    
+    # Cropping a large part of the page saves little, so keep the full page
+    if x2 <= x1 or y2 <= y1 or (x2 - x1) * (y2 - y1) > OCR_CROP_MAX_AREA * width * height:
+        return img, (0, 0)
+    return np.ascontiguousarray(img[y1:y2, x1:x2]), (x1, y1)
+
+def extract_text(page_images: Dict[int, np.ndarray], page_configs: Dict[int, List[Dict[str, Any]]]) -> List[Dict[str, str]]:
+    """Extract the text of every configured region from the rendered pages.
+    
+    Args:
+        page_images: Page images keyed by page number
+        page_configs: Configurations grouped by page number
+        
+    Returns:
+        List of dictionaries with the target cell and the text found for it
+    """
+    # Only the part of each page covered by its regions needs to be OCR'd
+    crops = {
+        page_num: crop_to_regions(img, [config['region'] for config in page_configs[page_num]])
+        for page_num, img in page_images.items()
+    }
+    if OCR_SCALE != 1.0:
+        crops = {
+            page_num: (cv2.resize(crop, None, fx=OCR_SCALE, fy=OCR_SCALE, interpolation=cv2.INTER_AREA), offset)
+            for page_num, (crop, offset) in crops.items()
+        }
+    
+    # Detect and recognize text on all pages in batches
+    page_ocr_results = dict(zip(crops, _read_pages([crop for crop, _ in crops.values()])))
+    
+    results = []
+    # Process each page once
+    for page_num, ocr_results in page_ocr_results.items():
+        boxes, texts, confidences = ocr_results_to_arrays(ocr_results)
+        
+        # Move the boxes from crop coordinates back to page coordinates
+        if OCR_SCALE != 1.0:
+            boxes /= OCR_SCALE
+        boxes += crops[page_num][1]
+        
+        # Select text in all regions of this page at once
+        configs = page_configs[page_num]
+        region_texts = select_text_in_regions(boxes, texts, confidences, [config['region'] for config in configs])
+        
+        # Process each region on this page
+        for config, found_texts in zip(configs, region_texts):
+            if found_texts:
+                combined_text = " ".join(text for text, _ in found_texts)
+                results.append({
+                    'target_cell': config['target_cell'],
+                    'text': combined_text
+                })
+            else:
+                results.append({
+                    'target_cell': config['target_cell'],
+                    'text': "No text found in the specified region"
+                })
+    
+    return results
+
+def _retry_on_quota(call: Callable[..., Any], *args: Any) -> Any:
+    """Call a Google Sheets API function, retrying with exponential backoff while the quota is exceeded.
+    
+    Args:
+        call: gspread function to call
+        *args: Arguments for the call
+        
+    Returns:
+        Result of the call
+    """
+    for attempt in range(SHEETS_MAX_ATTEMPTS):
+        try:
+            return call(*args)
+        except gspread.exceptions.APIError as e:
+            if e.response.status_code != 429 or attempt == SHEETS_MAX_ATTEMPTS - 1:
+                raise
+            # Wait 1, 2, 4, ... seconds (at most 60) plus jitter so retries do not line up
+            delay = min(2 ** attempt, 60) + random.uniform(0, 1)
+            print(f"Google Sheets quota exceeded, retrying in {delay:.1f} seconds...")
+            time.sleep(delay)
+
+def write_results(sheet: gspread.Spreadsheet, company_results: Dict[str, List[Dict[str, str]]]) -> None:
+    """Write extracted text of all companies to their worksheets in a single request.
+    
+    Args:
+        sheet: Google Sheet holding the results worksheets
+        company_results: Target cells and their text, keyed by company code,
+            which is also the name of the company's worksheet
+    """
+    try:
+        existing_worksheets = {worksheet.title for worksheet in sheet.worksheets()}
+    except Exception as e:
+        print(f"Error listing worksheets: {str(e)}")
+        return
+    
+    # Create the results worksheets that do not exist yet; a company whose
+    # worksheet cannot be created is left out so the others are still written
+    writable_results = {}
+    for code, results in company_results.items():
+        if code not in existing_worksheets:
+            try:
+                _retry_on_quota(sheet.add_worksheet, code, 1000, 10)
+            except Exception as e:
+                print(f"Error creating worksheet for company {code}: {str(e)}")
                 continue
-                
-            # Get the target page image
-            img = images[page_index]
-            
-            # Convert PIL image to numpy array
-            img_np = np.array(img)
-            
-            # Detect and recognize text once for all regions on this page
-            ocr_results = reader.readtext(img_np)
-            
-            # Process each region on this page
-            for config in configs:
-                # Select text in the region
-                found_texts = select_text_in_region(ocr_results, config['region'])
-                
-                if found_texts:
-                    # Sort texts by y-coordinate to maintain reading order
-                    found_texts.sort(key=lambda x: x[1])
-                    combined_text = " ".join(text for text, _ in found_texts)
-                    results.append({
-                        'target_cell': config['target_cell'],
-                        'text': combined_text
-                    })
-                else:
-                    results.append({
-                        'target_cell': config['target_cell'],
-                        'text': "No text found in the specified region"
-                    })
+        writable_results[code] = results
+    
+    # Save results of every company to their specific cells in a single request
+    updates = [
+        {'range': gspread.utils.absolute_range_name(code, result['target_cell']), 'values': [[result['text']]]}
+        for code, results in writable_results.items()
+        for result in results
+    ]
+    if updates:
+        try:
+            _retry_on_quota(sheet.values_batch_update, {'valueInputOption': 'USER_ENTERED', 'data': updates})
+            for code, results in writable_results.items():
+                if results:
+                    print(f"Updated cells {', '.join(result['target_cell'] for result in results)} of {code} with results")
+        except Exception as e:
+            print(f"Error updating cells: {str(e)}")
+
+def fetch_report(code: str) -> Optional[bytes]:
+    """Find and download the consolidated financial report of a company.
+    
+    Args:
+        code: Company code
         
-        return results
+    Returns:
+        Content of the PDF, or None if it could not be downloaded
+    """
+    # Get PDF URL
+    pdf_url = get_pdf_file(code)
+    if not pdf_url:
+        print(f"Could not find PDF URL for code {code}")
+        return None
+    
+    # Download PDF
+    return download_pdf(pdf_url)
+
+def save_company_images(code: str, start_page: int = 1, end_page: Optional[int] = None) -> None:
+    """Download the report of one company and save its pages as images.
+    
+    Args:
+        code: Company code
+        start_page: First page to save (1-based)
+        end_page: Last page to save (1-based), None for all pages
+    """
+    try:
+        print(f"\nProcessing company code: {code}")
+        pdf_bytes = fetch_report(code)
+        if not pdf_bytes:
+            return
+        
+        process_images_only(code, pdf_bytes, start_page, end_page)
+        print(f"Completed processing company {code}")
         
     except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
-        print("\nPlease make sure you have:")
-        print("1. Installed Poppler from: https://github.com/oschwartz10612/poppler-windows/releases/")
-        print("2. Set the correct POPPLER_PATH in the code to match your installation")
-        print("3. Installed EasyOCR using: pip install easyocr")
-        return []
+        print(f"Error processing company {code}: {str(e)}")
+
+def _hand_over_download(code: str, company_row: List[str], future: Future, downloaded: queue.Queue) -> None:
+    """Wait for a company's report download and pass it to the next stage."""
+    try:
+        pdf_bytes = future.result()
+        if pdf_bytes:
+            downloaded.put((code, company_row, pdf_bytes))
+    except Exception as e:
+        print(f"Error processing company {code}: {str(e)}")
+
+def _download_stage(companies: List[Tuple[str, List[str]]], downloaded: queue.Queue) -> None:
+    """Pipeline stage 1: download the reports of up to MAX_WORKERS companies at a time."""
+    try:
+        with ThreadPoolExecutor(MAX_WORKERS) as executor:
+            # Hand reports over in company order, keeping at most MAX_WORKERS in flight
+            in_flight: deque = deque()
+            for code, company_row in companies:
+                print(f"\nProcessing company code: {code}")
+                in_flight.append((code, company_row, executor.submit(fetch_report, code)))
+                if len(in_flight) >= MAX_WORKERS:
+                    _hand_over_download(*in_flight.popleft(), downloaded)
+            while in_flight:
+                _hand_over_download(*in_flight.popleft(), downloaded)
+    finally:
+        downloaded.put(None)
+
+def _render_stage(downloaded: queue.Queue, rendered: queue.Queue) -> None:
+    """Pipeline stage 2: render the configured pages of each downloaded report, page by page."""
+    try:
+        while True:
+            item = downloaded.get()
+            if item is None:
+                break
+            code, company_row, pdf_bytes = item
+            page_configs: Dict[int, List[Dict[str, Any]]] = {}
+            render_failed = False
+            try:
+                # Get all configurations
+                page_configs = parse_configs(company_row[2:])
+                # Hand each page over as soon as it is rendered so OCR can start
+                for page_num, img in render_configured_pages(pdf_bytes, page_configs):
+                    rendered.put((code, page_configs, page_num, img))
+            except Exception as e:
+                render_failed = True
+                print(f"Error processing PDF of company {code}: {str(e)}")
+                print("\nPlease make sure you have installed pypdfium2 using: pip install pypdfium2")
+            finally:
+                # Mark the end of this company's pages, in place of a page number
+                # and image, with whether rendering failed
+                rendered.put((code, page_configs, None, render_failed))
+    finally:
+        rendered.put(None)
+
+def extract_companies_text(sheet: gspread.Spreadsheet, companies: List[Tuple[str, List[str]]]) -> None:
+    """Extract configured text for several companies as a three-stage pipeline.
+    
+    Downloading, rendering and OCR run on separate threads connected by
+    bounded queues, so reports are downloaded, several at a time, while
+    another is rendered and a third is OCR'd. The OCR models are loaded once, in the background,
+    while the first report is downloaded. Pages reach OCR in batches as soon as they are
+    rendered, so rendering and OCR also overlap within a report. The results
+    are written once all companies are done.
+    
+    Args:
+        sheet: Google Sheet holding the results worksheets
+        companies: Company codes with their rows in the 'Company' worksheet
+    """
+    downloaded: queue.Queue = queue.Queue(maxsize=2)
+    rendered: queue.Queue = queue.Queue(maxsize=OCR_BATCH_SIZE)
+    stages = [
+        threading.Thread(target=_preload_reader, daemon=True),
+        threading.Thread(target=_download_stage, args=(companies, downloaded), daemon=True),
+        threading.Thread(target=_render_stage, args=(downloaded, rendered), daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+    
+    # Stage 3: OCR on this thread, a batch of pages at a time
+    company_results: Dict[str, List[Dict[str, str]]] = {}
+    failed_codes = set()
+    page_images: Dict[int, np.ndarray] = {}
+    while True:
+        item = rendered.get()
+        if item is None:
+            break
+        code, page_configs, page_num, img = item
+        if code in failed_codes:
+            continue
+        if page_num is not None:
+            page_images[page_num] = img
+            if len(page_images) < OCR_BATCH_SIZE:
+                continue
+        elif img:
+            # Rendering failed, so the company is incomplete; drop what was extracted
+            failed_codes.add(code)
+            company_results.pop(code, None)
+            page_images = {}
+            continue
+        
+        # A full batch, or the last pages of this company
+        try:
+            company_results.setdefault(code, []).extend(extract_text(page_images, page_configs))
+            if page_num is None:
+                print(f"Extracted text for company {code}")
+        except Exception as e:
+            failed_codes.add(code)
+            company_results.pop(code, None)
+            print(f"Error processing company {code}: {str(e)}")
+            print("\nPlease make sure you have installed EasyOCR using: pip install easyocr")
+        page_images = {}
+    
+    for stage in stages:
+        stage.join()
+    
+    # Write the results of all companies at once
+    if company_results:
+        write_results(sheet, company_results)
+        print(f"Completed processing companies {', '.join(company_results)}")
 
 def process_company_data(choice: int = 1) -> None:
     """Process company data from Google Sheets and extract text from PDFs."""
@@ -384,89 +991,48 @@ def process_company_data(choice: int = 1) -> None:
     sheet = get_sheet_data()
     if not sheet:
         return
-    
+
     # Get the company list worksheet
     company_worksheet = sheet.worksheet('Company')
     company_data = company_worksheet.get_all_values()
-    
-    # Get company code from user
-    code = get_company_code()
-    if not code:
+
+    # Get company codes from user
+    codes = get_company_codes()
+    if not codes:
         print("Operation cancelled by user")
         return
-        
-    # Find the company in the worksheet
-    company_row = None
+
+    # Find the companies in the worksheet
+    company_rows = {}
     for row in company_data[1:]:  # Skip header row
-        if row[1] == code:  # Company code is in second column
-            company_row = row
-            break
-            
-    if not company_row:
-        print(f"Company code {code} not found in the worksheet")
+        company_rows.setdefault(row[1], row)  # Company code is in second column
+
+    companies = []
+    for code in codes:
+        if code in company_rows:
+            companies.append((code, company_rows[code]))
+        else:
+            print(f"Company code {code} not found in the worksheet")
+    if not companies:
         return
-    
-    try:
-        print(f"\nProcessing company code: {code}")
-        
-        # Get PDF URL
-        pdf_url = get_pdf_file(code)
-        if not pdf_url:
-            print(f"Could not find PDF URL for code {code}")
-            return
-        
-        # Download PDF
-        pdf_file_path = f"reports/{pdf_url.split('/')[-1]}"
-        os.makedirs(os.path.dirname(pdf_file_path), exist_ok=True)
-        if not download_pdf(pdf_url, pdf_file_path):
+
+    if choice == 1:
+        # Get page range from user once for all companies
+        start_page, end_page = get_page_range()
+        if start_page is None:
+            print("Operation cancelled by user")
             return
-        
-        if choice == 1:
-            # Get page range from user
-            start_page, end_page = get_page_range()
-            if start_page is None or end_page is None:
-                print("Operation cancelled by user")
-                return
-            # Process images only
-            process_images_only(code, pdf_file_path, start_page, end_page)
-        else:
-            # Get all configurations
-            configs = [config for config in company_row[2:] if config]  # Skip empty configs
-            
-            # Create or get the results worksheet
-            try:
-                results_worksheet = sheet.worksheet(code)
-            except:
-                results_worksheet = sheet.add_worksheet(code, 1000, 10)
-            
-            # Process text only
-            results = process_text_only(pdf_file_path, configs)
-            
-            # Save results to specific cells
-            for result in results:
-                try:
-                    target_cell = result['target_cell']
-                    text = result['text']
-                    
-                    # Update cell with text (one cell below)
-                    next_row = int(target_cell[1:])
-                    next_col = ord(target_cell[0].upper()) - ord('A') + 1
-                    results_worksheet.update_cell(
-                        next_row,
-                        next_col,
-                        text
-                    )
-                    
-                    print(f"Updated cells {target_cell} and {chr(ord(target_cell[0]))}{int(target_cell[1:]) + 1} with results")
-                except Exception as e:
-                    print(f"Error updating cells: {str(e)}")
-        
-        # Clean up
-        os.remove(pdf_file_path)
-        print(f"Completed processing company {code}")
 
-    except Exception as e:
-        print(f"Error processing company {code}: {str(e)}")
+        # Companies are independent, so overlap their downloads and rendering
+        with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+            futures = [
+                executor.submit(save_company_images, code, start_page, end_page)
+                for code, _ in companies
+            ]
+            for future in as_completed(futures):
+                future.result()
+    else:
+        extract_companies_text(sheet, companies)
 
 def display_menu() -> None:
     """Display the main menu and get user choice."""